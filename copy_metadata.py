@@ -1,10 +1,14 @@
 import logging
 import os
+import queue
 import re
 import shutil
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
 from logging import getLogger
 from pathlib import Path
-from typing import Iterator, TypeVar, Union
+from typing import Iterator, List, Optional, Set, TypeVar
 
 logging.basicConfig(
     format="[%(asctime)s][%(levelname)s][%(filename)s:%(lineno)d] - %(message)s",
@@ -16,66 +20,104 @@ logger.setLevel(logging.INFO)
 _PathLike = TypeVar("_PathLike", Path, str)
 
 
-def get_search_file_iterator(dirpath: _PathLike, pattern) -> Iterator[Path]:
-    count: int = 0
-    for _dirpath, _dirnames, _filenames in os.walk(str(dirpath)):
-        for _filename in _filenames:
-            if count % 1000 == 0:
-                logger.info(f"count: {count}, {_filename}, {pattern.match(string=_filename)}")
-            count += 1
-
-            if pattern.match(string=_filename) is not None:
-                yield Path(_dirpath) / _filename
-
-def myfunc():
-    pass
-
-def myfunc_wrapper(args_dict: Dict[Any, Any]):
-    return myfunc(**args_dict)
-
-class TmpIterator:
-    def __init__(self, dirpath: _PathLike, pattern):
-        self.dirpath: _PathLike = dirpath
-        self.pattern = pattern
-
-    def __iter__(self):
-        for data_pair_idx, data_pair in enumerate(self.data_list):
-            yield dict(
-                data_pair=data_pair,
-                model_input_image_size_hw=model_input_image_size_hw,
-                out_dir_path=out_dir_path,
-                semaseg_id_to_bbox_id=semaseg_id_to_bbox_id,
-                is_train=is_train,
-                area_threashold=0,
-                debug_index=data_pair_idx,
-            )
-    def get_search_file_iterator() -> Iterator[Path]:
-        count: int = 0
-        for _dirpath, _dirnames, _filenames in os.walk(str(self.dirpath)):
+def _put_unless_stopped(filepath_queue: queue.Queue, item: Optional[Path], stop_event: threading.Event) -> bool:
+    """Put item into the bounded queue, giving up once the consumer has stopped reading it"""
+    while not stop_event.is_set():
+        try:
+            filepath_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _walk_into_queue(dirpath: str, pattern, filepath_queue: queue.Queue, stop_event: threading.Event) -> None:
+    try:
+        for _dirpath, _dirnames, _filenames in os.walk(dirpath):
             for _filename in _filenames:
+                if pattern.match(string=_filename) is not None:
+                    if not _put_unless_stopped(filepath_queue, Path(_dirpath) / _filename, stop_event):
+                        return
+    finally:
+        # tell the consumer this walker is done
+        _put_unless_stopped(filepath_queue, None, stop_event)
+
+
+def get_search_file_iterator(dirpath: _PathLike, pattern, num_workers: int = 8) -> Iterator[Path]:
+    """Walk each top-level sub-directory (one per ShapeNet category) in its own thread
+
+    Matches are yielded as soon as any walker finds them, so the consumer can start working
+    before the whole tree has been scanned. The queue between walkers and consumer is bounded,
+    so walkers wait for the consumer instead of holding every match of the tree in memory.
+    """
+    subdirpaths: List[str] = []
+    for entry in os.scandir(str(dirpath)):
+        if entry.is_dir():
+            subdirpaths.append(entry.path)
+        elif pattern.match(string=entry.name) is not None:
+            yield Path(entry.path)
+
+    filepath_queue: queue.Queue = queue.Queue(maxsize=num_workers * 8)
+    stop_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        walker_futures: List[Future] = [
+            executor.submit(_walk_into_queue, _subdirpath, pattern, filepath_queue, stop_event)
+            for _subdirpath in subdirpaths
+        ]
+
+        try:
+            count: int = 0
+            num_running: int = len(subdirpaths)
+            while num_running > 0:
+                filepath: Optional[Path] = filepath_queue.get()
+                if filepath is None:
+                    num_running -= 1
+                    continue
                 if count % 1000 == 0:
-                    logger.info(f"count: {count}, {_filename}, {self.pattern.match(string=_filename)}")
+                    logger.info(f"count: {count}, {filepath}")
                 count += 1
+                yield filepath
+        finally:
+            # release walkers waiting on the full queue when the consumer stops early
+            stop_event.set()
+
+        for future in walker_futures:
+            future.result()  # re-raise errors of the walkers
 
-                if self.pattern.match(string=_filename) is not None:
-                    yield Path(_dirpath) / _filename
 
-# pool: multiprocessing.Pool
-with multiprocessing.Pool(num_workers) as pool:
-    pool.map(func=myfunc_wrapper, iterable=TmpIterator(data_list))
+def copy_metadata(filepath: Path, input_root_dirpath: Path, output_root_dirpath: Path) -> Path:
+    relative_path = filepath.relative_to(input_root_dirpath)
+    save_filepath: Path = output_root_dirpath / relative_path.parents[1] / relative_path.name
+    assert save_filepath.parent.exists(), save_filepath
+    shutil.copyfile(filepath, save_filepath)
+    return save_filepath
+
 
 def main():
     input_root_dirpath: Path = Path("datasets/data/shapenet/data_tf")
     output_root_dirpath: Path = Path("datasets/data/shapenet/data_tf_2021-12-17")
+    # copying is bound by disk I/O, which releases the GIL, so threads are enough
+    num_workers: int = 16
     pattern = re.compile(
         pattern=r"rendering_metadata.txt",
         # flags=re.IGNORECASE,
     )
-    for filepath in get_search_file_iterator(dirpath=input_root_dirpath, pattern=pattern):
-        relative_path = filepath.relative_to(input_root_dirpath)
-        save_filepath: Path = output_root_dirpath / relative_path.parents[1] / relative_path.name
-        assert save_filepath.parent.exists(), save_filepath
-        shutil.copyfile(filepath, save_filepath)
+    copy_fn = partial(copy_metadata, input_root_dirpath=input_root_dirpath, output_root_dirpath=output_root_dirpath)
+    # executor.map would submit a future for every file up front and keep them all until the end,
+    # so at most max_in_flight files are submitted at a time and each is released once it is done;
+    # together with the bounded queue of get_search_file_iterator, the paths held stay O(num_workers)
+    max_in_flight: int = 2 * num_workers
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending: Set[Future] = set()
+        for filepath in get_search_file_iterator(input_root_dirpath, pattern, num_workers):
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()  # re-raise errors of the copy
+            pending.add(executor.submit(copy_fn, filepath))
+        for future in wait(pending).done:
+            future.result()
+
 
 if __name__ == "__main__":
     main()
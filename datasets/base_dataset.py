@@ -1,3 +1,5 @@
+import numpy as np
+import torch
 from torch.utils.data.dataset import Dataset
 from torchvision.transforms import Normalize
 
@@ -8,3 +10,13 @@ class BaseDataset(Dataset):
 
     def __init__(self):
         self.normalize_img = Normalize(mean=config.IMG_NORM_MEAN, std=config.IMG_NORM_STD)
+
+    @staticmethod
+    def image_to_tensor(img, dtype=np.float32):
+        """
+        :param img: H x W x C image array, C >= 3
+        :param dtype: dtype of the returned tensor
+        :return: 3 x H x W contiguous tensor of the RGB channels
+        Slicing, casting and HWC -> CHW transposing are done by one copy.
+        """
+        return torch.from_numpy(np.ascontiguousarray(img[:, :, :3].transpose(2, 0, 1), dtype=dtype))
@@ -0,0 +1,31 @@
+from torch.utils.data.sampler import Sampler
+
+
+class RepeatSampler(Sampler):
+    """
+    Restart the wrapped (batch) sampler every time it is exhausted.
+
+    A DataLoader driven by this sampler never stops, so a single iterator and its worker
+    processes can be kept alive for the whole training run instead of being forked again
+    every epoch (DataLoader has no `persistent_workers` option in our version of PyTorch).
+    `len()` is the length of one pass, i.e. one epoch.
+    Samplers with `set_epoch` (DistributedSampler), also inside a BatchSampler, are told the pass number,
+    counted from `start_epoch` so that a resumed run does not replay the shuffles of the first epochs.
+    """
+
+    # like BatchSampler, Sampler.__init__ is not called: newer versions of PyTorch take no argument for it
+    def __init__(self, sampler, start_epoch=0):
+        self.sampler = sampler
+        self.start_epoch = start_epoch
+
+    def __iter__(self):
+        epoch = self.start_epoch
+        while True:
+            sampler = getattr(self.sampler, "sampler", self.sampler)
+            if hasattr(sampler, "set_epoch"):
+                sampler.set_epoch(epoch)
+            yield from iter(self.sampler)
+            epoch += 1
+
+    def __len__(self):
+        return len(self.sampler)
@@ -1,23 +1,85 @@
 import json
 import os
 import pickle
+from collections import OrderedDict
 
+import cv2
 import numpy as np
 import torch
 from PIL import Image
-from skimage import io, transform
+from skimage import transform
 from torch.utils.data.dataloader import default_collate
 
 import config
 from datasets.base_dataset import BaseDataset
 
+# every DataLoader worker is a process of its own, OpenCV threads would only oversubscribe the cores
+cv2.setNumThreads(1)
+
+
+def read_image(img_path):
+    """
+    Read an image with OpenCV as RGB(A), keeping the alpha channel
+    """
+    img = cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise IOError("Cannot read image %s" % img_path)
+    if img.dtype == np.uint16:
+        # IMREAD_UNCHANGED keeps 16-bit PNGs, the rest of the pipeline expects the 8-bit range
+        img = (img // 257).astype(np.uint8)
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA if img.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+
+
+def resize_image(img, constant_border=False):
+    """
+    :param img: H x W x C uint8 image
+    :param constant_border: resize with skimage and constant padding, to match behavior of old versions
+    :return: 3 x IMG_SIZE x IMG_SIZE tensor, uint8 or, with constant_border, float in [0, 1]
+    Use image_to_unit_range to get a float tensor in [0, 1] in both cases.
+    """
+    if constant_border:
+        img = transform.resize(img, (config.IMG_SIZE, config.IMG_SIZE), mode='constant', anti_aliasing=False)
+        return BaseDataset.image_to_tensor(img)
+    # OpenCV stays in uint8 until the final cast; average pixels when shrinking, bilinear when enlarging
+    shrinking = img.shape[0] >= config.IMG_SIZE and img.shape[1] >= config.IMG_SIZE
+    interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+    return BaseDataset.image_to_tensor(cv2.resize(img, (config.IMG_SIZE, config.IMG_SIZE),
+                                                  interpolation=interpolation), dtype=np.uint8)
+
+
+def image_to_unit_range(img):
+    """
+    :param img: image tensor, uint8 or float in [0, 1]
+    :return: float tensor in [0, 1]
+    """
+    return img.float().div_(255.0) if img.dtype == torch.uint8 else img
+
+
+def fill_transparent_background(img):
+    """
+    Paint fully transparent pixels of an RGBA image white, in place.
+    The alpha mask is broadcast over the channels, so this is a single pass without index arrays.
+    """
+    np.copyto(img, 255, where=img[:, :, 3:4] == 0)
+    return img
+
+
+def packed_points_dir(file_root, file_list_name):
+    """
+    Directory holding the memory-mapped point clouds of a file list, see utils/migrations/pack_shapenet_points.py
+    points.bin: float32, total_num_points x 6 (xyz + normal); offsets.npy: int64, (num_samples + 1)
+    """
+    return os.path.join(file_root, "packed", file_list_name)
+
 
 class ShapeNet(BaseDataset):
     """
     Dataset wrapping images and target meshes for ShapeNet dataset.
     """
 
-    def __init__(self, file_root, file_list_name, mesh_pos, normalization, shapenet_options):
+    def __init__(self, file_root, file_list_name, mesh_pos, normalization, shapenet_options, cache_size=0):
         super().__init__()
         self.file_root = file_root
         with open(os.path.join(self.file_root, "meta", "shapenet.json"), "r") as fp:
@@ -28,37 +90,78 @@ class ShapeNet(BaseDataset):
             self.file_names = fp.read().split("\n")[:-1]
         self.tensorflow = "_tf" in file_list_name # tensorflow version of data
         self.normalization = normalization
-        self.mesh_pos = mesh_pos
+        # converted once here instead of on every __getitem__
+        self.mesh_pos = np.asarray(mesh_pos, dtype=np.float32)
         self.resize_with_constant_border = shapenet_options.resize_with_constant_border
+        self.packed_dir, self.packed_offsets, self.packed_points = None, None, None
+        if shapenet_options.memmap_points:
+            if not self.tensorflow:
+                raise ValueError("Memory-mapped point clouds are only supported for tensorflow version of data")
+            self.packed_dir = packed_points_dir(self.file_root, file_list_name)
+            self.packed_offsets = np.load(os.path.join(self.packed_dir, "offsets.npy"))
+            if len(self.packed_offsets) != len(self.file_names) + 1:
+                raise ValueError("Packed point clouds in %s do not match %s" % (self.packed_dir, file_list_name))
+        # every DataLoader worker fills its own copy of the cache, see options.dataset.shapenet.cache_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
 
-    def __getitem__(self, index):
+    def tf_file(self, index):
+        """
+        :return: label, filename and pickle path of a sample in tensorflow version of data
+        """
+        filename = self.file_names[index][17:]
+        label = filename.split("/", maxsplit=1)[0]
+        return label, filename, os.path.join(self.file_root, "data_tf", filename)
+
+    def load_tf_points(self, index, pkl_path):
+        if self.packed_offsets is None:
+            with open(pkl_path, "rb") as f:
+                return pickle.load(f, encoding="latin1")
+        if self.packed_points is None:
+            # mapped lazily, so that every DataLoader worker opens the shard by itself
+            self.packed_points = np.memmap(os.path.join(self.packed_dir, "points.bin"),
+                                           dtype=np.float32, mode="r").reshape(-1, 6)
+        # copy the rows out of the read-only mapping
+        return np.array(self.packed_points[self.packed_offsets[index]:self.packed_offsets[index + 1]])
+
+    def load_sample(self, index):
+        """
+        :return: label, filename, image (see resize_image), points (relative to mesh_pos) and normals of a sample
+        """
         if self.tensorflow:
-            filename = self.file_names[index][17:]
-            label = filename.split("/", maxsplit=1)[0]
-            pkl_path = os.path.join(self.file_root, "data_tf", filename)
+            label, filename, pkl_path = self.tf_file(index)
             img_path = pkl_path[:-4] + ".png"
-            with open(pkl_path) as f:
-                data = pickle.load(open(pkl_path, 'rb'), encoding="latin1")
+            data = self.load_tf_points(index, pkl_path)
             pts, normals = data[:, :3], data[:, 3:]
-            img = io.imread(img_path)
-            img[np.where(img[:, :, 3] == 0)] = 255
-            if self.resize_with_constant_border:
-                img = transform.resize(img, (config.IMG_SIZE, config.IMG_SIZE),
-                                       mode='constant', anti_aliasing=False)  # to match behavior of old versions
-            else:
-                img = transform.resize(img, (config.IMG_SIZE, config.IMG_SIZE))
-            img = img[:, :, :3].astype(np.float32)
+            img = fill_transparent_background(read_image(img_path))
+            img = resize_image(img, self.resize_with_constant_border)
         else:
             label, filename = self.file_names[index].split("_", maxsplit=1)
             with open(os.path.join(self.file_root, "data", label, filename), "rb") as f:
                 data = pickle.load(f, encoding="latin1")
-            img, pts, normals = data[0].astype(np.float32) / 255.0, data[1][:, :3], data[1][:, 3:]
+            img, pts, normals = self.image_to_tensor(data[0]), data[1][:, :3], data[1][:, 3:]
+            img /= 255.0
 
-        pts -= np.array(self.mesh_pos)
+        pts -= self.mesh_pos
         assert pts.shape[0] == normals.shape[0]
+        return label, filename, img, pts, normals
+
+    def __getitem__(self, index):
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            sample = self.cache[index]
+        else:
+            sample = self.load_sample(index)
+            if self.cache_size > 0:
+                # the image is cached before its float conversion, in uint8 a quarter of the size;
+                # points are handed out as they are, nothing downstream modifies them in place
+                self.cache[index] = sample
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        label, filename, img, pts, normals = sample
+        img = image_to_unit_range(img)
         length = pts.shape[0]
 
-        img = torch.from_numpy(np.transpose(img, (2, 0, 1)))
         img_normalized = self.normalize_img(img) if self.normalization else img
 
         return {
@@ -95,19 +198,12 @@ class ShapeNetImageFolder(BaseDataset):
 
     def __getitem__(self, item):
         img_path = self.file_list[item]
-        img = io.imread(img_path)
+        img = read_image(img_path)
 
         if img.shape[2] > 3:  # has alpha channel
-            img[np.where(img[:, :, 3] == 0)] = 255
+            fill_transparent_background(img)
 
-        if self.resize_with_constant_border:
-            img = transform.resize(img, (config.IMG_SIZE, config.IMG_SIZE),
-                                   mode='constant', anti_aliasing=False)
-        else:
-            img = transform.resize(img, (config.IMG_SIZE, config.IMG_SIZE))
-        img = img[:, :, :3].astype(np.float32)
-
-        img = torch.from_numpy(np.transpose(img, (2, 0, 1)))
+        img = image_to_unit_range(resize_image(img, self.resize_with_constant_border))
         img_normalized = self.normalize_img(img) if self.normalization else img
 
         return {
@@ -125,6 +221,20 @@ def get_shapenet_collate(num_points):
     :param num_points: This option will not be activated when batch size = 1
     :return: shapenet_collate function
     """
+    rng_state = {}
+
+    def sample_indices(length):
+        # DataLoader seeds torch differently in every worker; numpy state would be the same in all forked workers
+        seed = torch.initial_seed()
+        if rng_state.get("seed") != seed:
+            rng_state["seed"], rng_state["rng"] = seed, np.random.default_rng(seed)
+        rng = rng_state["rng"]
+        if length >= num_points:
+            # partial Fisher-Yates, drawing num_points instead of length random numbers
+            return rng.choice(length, num_points, replace=False, shuffle=False)
+        # use every point at least once
+        return np.resize(rng.permutation(length), num_points)
+
     def shapenet_collate(batch):
         if len(batch) > 1:
             all_equal = True
@@ -134,14 +244,20 @@ def get_shapenet_collate(num_points):
                     break
             points_orig, normals_orig = [], []
             if not all_equal:
-                for t in batch:
-                    pts, normal = t["points"], t["normals"]
+                # gather the sampled rows straight into the batch tensors instead of stacking per-sample copies
+                points = torch.empty((len(batch), num_points, 3), dtype=torch.float32)
+                normals = torch.empty((len(batch), num_points, 3), dtype=torch.float32)
+                for i, t in enumerate(batch):
+                    pts, normal = t.pop("points"), t.pop("normals")
                     length = pts.shape[0]
-                    choices = np.resize(np.random.permutation(length), num_points)
-                    t["points"], t["normals"] = pts[choices], normal[choices]
+                    choices = sample_indices(length)
+                    # mode other than "raise" lets numpy write into out without an intermediate buffer
+                    np.take(pts, choices, axis=0, out=points[i].numpy(), mode="clip")
+                    np.take(normal, choices, axis=0, out=normals[i].numpy(), mode="clip")
                     points_orig.append(torch.from_numpy(pts))
                     normals_orig.append(torch.from_numpy(normal))
                 ret = default_collate(batch)
+                ret["points"], ret["normals"] = points, normals
                 ret["points_orig"] = points_orig
                 ret["normals_orig"] = normals_orig
                 return ret
@@ -1,6 +1,10 @@
 import argparse
+import os
 import sys
 
+import torch
+import torch.distributed
+
 from functions.trainer import Trainer
 from options import update_options, options, reset_options
 
@@ -21,15 +25,33 @@ def parse_args():
     parser.add_argument('--num-epochs', help='number of epochs', type=int)
     parser.add_argument('--version', help='version of task (timestamp by default)', type=str)
     parser.add_argument('--name', required=True, type=str)
+    # set by torch.distributed.launch
+    parser.add_argument('--local_rank', help='GPU of this process in distributed training', default=0, type=int)
 
     args = parser.parse_args()
 
     return args
 
 
+def init_distributed(args):
+    """
+    Initialize the process group when started by `python -m torch.distributed.launch --nproc_per_node=N`.
+    Each process then trains on its own GPU with DistributedDataParallel.
+    :return: rank of this process, 0 if not distributed
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return 0
+    if not args.version:
+        raise ValueError("Distributed training needs --version so that all processes share one checkpoint directory")
+    torch.cuda.set_device(args.local_rank)
+    torch.distributed.init_process_group(backend="nccl", init_method="env://")
+    return torch.distributed.get_rank()
+
+
 def main():
     args = parse_args()
-    logger, writer = reset_options(options, args)
+    rank = init_distributed(args)
+    logger, writer = reset_options(options, args, phase='train' if rank == 0 else 'train_rank%d' % rank)
 
     trainer = Trainer(options, logger, writer)
     trainer.train()
@@ -4,6 +4,7 @@ from datetime import timedelta
 from logging import Logger
 
 import torch
+import torch.distributed
 import torch.nn
 from tensorboardX import SummaryWriter
 from torch.utils.data.dataloader import default_collate
@@ -20,10 +21,19 @@ class CheckpointRunner(object):
         self.options = options
         self.logger = logger
 
+        # Distributed training runs one process per GPU, see entrypoint_train.py
+        self.distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        self.rank = torch.distributed.get_rank() if self.distributed else 0
+
         # GPUs
         if not torch.cuda.is_available() and self.options.num_gpus > 0:
             raise ValueError("CUDA not found yet number of GPUs is set to be greater than 0")
-        if os.environ.get("CUDA_VISIBLE_DEVICES"):
+        if self.distributed:
+            # the device of this process is selected by the entrypoint; num_gpus counts all processes
+            self.gpus = [torch.cuda.current_device()]
+            self.options.num_gpus = torch.distributed.get_world_size()
+            logger.info("Distributed rank %d of %d, using GPU %d" % (self.rank, self.options.num_gpus, self.gpus[0]))
+        elif os.environ.get("CUDA_VISIBLE_DEVICES"):
             logger.info("CUDA visible devices is activated here, number of GPU setting is not working")
             self.gpus = list(map(int, os.environ["CUDA_VISIBLE_DEVICES"].split(",")))
             self.options.num_gpus = len(self.gpus)
@@ -63,8 +73,10 @@ class CheckpointRunner(object):
     def load_dataset(self, dataset, training):
         self.logger.info("Loading datasets: %s" % dataset.name)
         if dataset.name == "shapenet":
+            # evaluation builds a new DataLoader on every run, its worker caches would never be hit
             return ShapeNet(config.SHAPENET_ROOT, dataset.subset_train if training else dataset.subset_eval,
-                            dataset.mesh_pos, dataset.normalization, dataset.shapenet)
+                            dataset.mesh_pos, dataset.normalization, dataset.shapenet,
+                            cache_size=dataset.shapenet.cache_size if training else 0)
         elif dataset.name == "shapenet_demo":
             return ShapeNetImageFolder(dataset.predict.folder, dataset.normalization, dataset.shapenet)
         elif dataset.name == "imagenet":
@@ -80,6 +92,13 @@ class CheckpointRunner(object):
     def init_fn(self, shared_model=None, **kwargs):
         raise NotImplementedError('You need to provide an _init_fn method')
 
+    @staticmethod
+    def unwrap_model(model):
+        if isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)):
+            model = model.module
+        # modules compiled by torch.compile keep their weights in the original module
+        return getattr(model, "_orig_mod", model)
+
     # Pack models and optimizers in a dict - necessary for checkpointing
     def models_dict(self):
         return None
@@ -95,14 +114,15 @@ class CheckpointRunner(object):
             return
         for model_name, model in self.models_dict().items():
             if model_name in checkpoint:
-                if isinstance(model, torch.nn.DataParallel):
-                    model.module.load_state_dict(checkpoint[model_name], strict=False)
-                else:
-                    model.load_state_dict(checkpoint[model_name], strict=False)
+                self.unwrap_model(model).load_state_dict(checkpoint[model_name], strict=False)
         if self.optimizers_dict() is not None:
             for optimizer_name, optimizer in self.optimizers_dict().items():
                 if optimizer_name in checkpoint:
-                    optimizer.load_state_dict(checkpoint[optimizer_name])
+                    try:
+                        optimizer.load_state_dict(checkpoint[optimizer_name])
+                    except ValueError:
+                        # e.g. checkpoints from when fixed tensors of the model were registered as parameters
+                        self.logger.warning("%s does not match the checkpoint, skipping..." % optimizer_name)
         else:
             self.logger.warning("Optimizers not found in the runner, skipping...")
         if "epoch" in checkpoint:
@@ -111,15 +131,15 @@ class CheckpointRunner(object):
             self.step_count = checkpoint["total_step_count"]
 
     def dump_checkpoint(self):
+        if self.rank != 0:
+            # all processes hold the same weights
+            return
         checkpoint = {
             "epoch": self.epoch_count,
             "total_step_count": self.step_count
         }
         for model_name, model in self.models_dict().items():
-            if isinstance(model, torch.nn.DataParallel):
-                checkpoint[model_name] = model.module.state_dict()
-            else:
-                checkpoint[model_name] = model.state_dict()
+            checkpoint[model_name] = self.unwrap_model(model).state_dict()
             for k, v in list(checkpoint[model_name].items()):
                 if isinstance(v, torch.Tensor) and v.is_sparse:
                     checkpoint[model_name].pop(k)
@@ -36,6 +36,9 @@ class Evaluator(CheckpointRunner):
         self.num_classes = self.options.dataset.num_classes
 
         if shared_model is not None:
+            # a DistributedDataParallel forward talks to all processes, but only one of them evaluates
+            if isinstance(shared_model, torch.nn.parallel.DistributedDataParallel):
+                shared_model = shared_model.module
             self.model = shared_model
         else:
             if self.options.model.name == "pixel2mesh":
@@ -122,7 +125,7 @@ class Evaluator(CheckpointRunner):
         self.evaluate_step_count = 0
 
         test_data_loader = DataLoader(self.dataset,
-                                      batch_size=self.options.test.batch_size * self.options.num_gpus,
+                                      batch_size=self.options.test.batch_size * len(self.gpus),
                                       num_workers=self.options.num_workers,
                                       pin_memory=self.options.pin_memory,
                                       shuffle=self.options.test.shuffle,
@@ -139,7 +142,7 @@ class Evaluator(CheckpointRunner):
         # Iterate over all batches in an epoch
         for step, batch in enumerate(test_data_loader):
             # Send input to GPU
-            batch = {k: v.cuda() if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+            batch = {k: v.cuda(non_blocking=True) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
 
             # Run evaluation step
             out = self.evaluate_step(batch)
@@ -187,7 +190,7 @@ class Evaluator(CheckpointRunner):
     def evaluate_summaries(self, input_batch, out_summary):
         self.logger.info("Test Step %06d/%06d (%06d) " % (self.evaluate_step_count,
                                                           len(self.dataset) // (
-                                                                  self.options.num_gpus * self.options.test.batch_size),
+                                                                  len(self.gpus) * self.options.test.batch_size),
                                                           self.total_step_count,) \
                          + ", ".join([key + " " + (str(val) if isinstance(val, AverageMeter) else "%.6f" % val)
                                       for key, val in self.get_result_summary().items()]))
@@ -25,11 +25,12 @@ class CheckpointSaver(object):
             self.logger.info("Checkpoint file not found, skipping...")
             return None
         self.logger.info("Loading checkpoint file: %s" % self.checkpoint_file)
+        # load to CPU, so that every process of a distributed run does not allocate on the GPU it was saved from
         try:
-            return torch.load(self.checkpoint_file)
+            return torch.load(self.checkpoint_file, map_location="cpu")
         except UnicodeDecodeError:
             # to be compatible with old encoding methods
-            return torch.load(self.checkpoint_file, encoding="bytes")
+            return torch.load(self.checkpoint_file, map_location="cpu", encoding="bytes")
 
     def save_checkpoint(self, obj, name):
         self.checkpoint_file = os.path.join(self.save_dir, "%s.pt" % name)
@@ -1,10 +1,14 @@
+import inspect
 import time
 from datetime import timedelta
 
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from torch.utils.data.sampler import BatchSampler, RandomSampler, SequentialSampler
 
+from datasets.sampler import RepeatSampler
 from functions.base import CheckpointRunner
 from functions.evaluator import Evaluator
 from models.classifier import Classifier
@@ -13,7 +17,7 @@ from models.losses.p2m import P2MLoss
 from models.p2m import P2MModel
 from utils.average_meter import AverageMeter
 from utils.mesh import Ellipsoid
-from utils.tensor import recursive_detach
+from utils.tensor import recursive_detach, recursive_float
 from utils.vis.renderer import MeshRenderer
 
 
@@ -42,15 +46,34 @@ class Trainer(CheckpointRunner):
                 self.model = Classifier(self.options.model, self.options.dataset.num_classes)
             else:
                 raise NotImplementedError("Your model is not found")
-            self.model = torch.nn.DataParallel(self.model, device_ids=self.gpus).cuda()
+            if self.options.train.compile_model:
+                # the mesh topology is fixed, so the whole GCN can be specialized into fused kernels
+                if not hasattr(torch, "compile"):
+                    raise NotImplementedError("Compiling the model needs PyTorch >= 2.0")
+                if not self.distributed and len(self.gpus) > 1:
+                    raise ValueError("Compiling the model on several GPUs needs distributed training")
+                self.model = torch.compile(self.model, dynamic=False)
+            if self.distributed:
+                # some parameters may get no gradient, e.g. the reconstruction decoder when its loss weight is 0
+                self.model = torch.nn.parallel.DistributedDataParallel(self.model.cuda(), device_ids=self.gpus,
+                                                                       broadcast_buffers=False,
+                                                                       find_unused_parameters=True)
+            else:
+                self.model = torch.nn.DataParallel(self.model, device_ids=self.gpus).cuda()
 
         # Setup a joint optimizer for the 2 models
         if self.options.optim.name == "adam":
+            adam_kwargs = {}
+            if self.options.optim.adam_fused:
+                if "fused" not in inspect.signature(torch.optim.Adam).parameters:
+                    raise NotImplementedError("Fused Adam needs PyTorch >= 2.0")
+                adam_kwargs["fused"] = True
             self.optimizer = torch.optim.Adam(
                 params=list(self.model.parameters()),
                 lr=self.options.optim.lr,
                 betas=(self.options.optim.adam_beta1, 0.999),
-                weight_decay=self.options.optim.wd
+                weight_decay=self.options.optim.wd,
+                **adam_kwargs
             )
         elif self.options.optim.name == "sgd":
             self.optimizer = torch.optim.SGD(
@@ -65,6 +88,16 @@ class Trainer(CheckpointRunner):
             self.optimizer, self.options.optim.lr_step, self.options.optim.lr_factor
         )
 
+        # Mixed precision: the model runs in float16 where safe, gradients are scaled to avoid underflow
+        self.mixed_precision = self.options.train.mixed_precision
+        if self.mixed_precision:
+            if not hasattr(torch.cuda, "amp"):
+                raise NotImplementedError("Mixed precision training needs PyTorch >= 1.6")
+            if not self.distributed and len(self.gpus) > 1:
+                # autocast is thread local and would not reach the threads of DataParallel replicas
+                raise ValueError("Mixed precision on several GPUs needs distributed training")
+            self.scaler = torch.cuda.amp.GradScaler()
+
         # Create loss functions
         if self.options.model.name == "pixel2mesh":
             self.criterion = P2MLoss(self.options.loss, self.ellipsoid).cuda()
@@ -76,15 +109,35 @@ class Trainer(CheckpointRunner):
         # Create AverageMeters for losses
         self.losses = AverageMeter()
 
-        # Evaluators
-        self.evaluators = [Evaluator(self.options, self.logger, self.summary_writer, shared_model=self.model)]
+        # Create the data loader once; it repeats its sampler forever, so worker processes survive across epochs
+        if self.distributed:
+            # every process draws its own shard, always shuffled
+            sampler = DistributedSampler(self.dataset)
+            batch_size = self.options.train.batch_size
+        else:
+            sampler = RandomSampler(self.dataset) if self.options.train.shuffle else SequentialSampler(self.dataset)
+            batch_size = self.options.train.batch_size * self.options.num_gpus
+        self.train_sampler = RepeatSampler(BatchSampler(sampler, batch_size=batch_size, drop_last=False))
+        self.train_data_loader = DataLoader(self.dataset,
+                                            batch_sampler=self.train_sampler,
+                                            num_workers=self.options.num_workers,
+                                            pin_memory=self.options.pin_memory,
+                                            collate_fn=self.dataset_collate_fn)
+
+        # Evaluators; when distributed, only the first process evaluates
+        self.evaluators = []
+        if self.rank == 0:
+            self.evaluators.append(Evaluator(self.options, self.logger, self.summary_writer, shared_model=self.model))
 
     def models_dict(self):
         return {'model': self.model}
 
     def optimizers_dict(self):
-        return {'optimizer': self.optimizer,
-                'lr_scheduler': self.lr_scheduler}
+        optimizers = {'optimizer': self.optimizer,
+                      'lr_scheduler': self.lr_scheduler}
+        if self.mixed_precision:
+            optimizers['scaler'] = self.scaler
+        return optimizers
 
     def train_step(self, input_batch):
         self.model.train()
@@ -93,40 +146,52 @@ class Trainer(CheckpointRunner):
         images = input_batch["images"]
 
         # predict with model
-        out = self.model(images)
+        if self.mixed_precision:
+            with torch.cuda.amp.autocast():
+                out = self.model(images)
+            # losses, including the chamfer CUDA kernel, are computed in float32
+            out = recursive_float(out)
+        else:
+            out = self.model(images)
 
         # compute loss
         loss, loss_summary = self.criterion(out, input_batch)
-        self.losses.update(loss.detach().cpu().item())
+        self.losses.update(loss.detach())
 
         # Do backprop
-        self.optimizer.zero_grad()
-        loss.backward()
-        self.optimizer.step()
+        # gradients are dropped rather than zeroed, backward then writes them anew without a memset per parameter
+        for group in self.optimizer.param_groups:
+            for param in group["params"]:
+                param.grad = None
+        if self.mixed_precision:
+            self.scaler.scale(loss).backward()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+        else:
+            loss.backward()
+            self.optimizer.step()
 
         # Pack output arguments to be used for visualization
         return recursive_detach(out), recursive_detach(loss_summary)
 
     def train(self):
+        # A single iterator is used for all epochs, see RepeatSampler; epoch_count is known once the checkpoint is loaded
+        self.train_sampler.start_epoch = self.epoch_count
+        train_data_iter = iter(self.train_data_loader)
+
         # Run training for num_epochs epochs
         for epoch in range(self.epoch_count, self.options.train.num_epochs):
             self.epoch_count += 1
 
-            # Create a new data loader for every epoch
-            train_data_loader = DataLoader(self.dataset,
-                                           batch_size=self.options.train.batch_size * self.options.num_gpus,
-                                           num_workers=self.options.num_workers,
-                                           pin_memory=self.options.pin_memory,
-                                           shuffle=self.options.train.shuffle,
-                                           collate_fn=self.dataset_collate_fn)
-
             # Reset loss
             self.losses.reset()
 
             # Iterate over all batches in an epoch
-            for step, batch in enumerate(train_data_loader):
+            for step in range(len(self.train_data_loader)):
+                batch = next(train_data_iter)
+
                 # Send input to GPU
-                batch = {k: v.cuda() if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+                batch = {k: v.cuda(non_blocking=True) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
 
                 # Run training step
                 out = self.train_step(batch)
@@ -134,7 +199,7 @@ class Trainer(CheckpointRunner):
                 self.step_count += 1
 
                 # Tensorboard logging every summary_steps steps
-                if self.step_count % self.options.train.summary_steps == 0:
+                if self.rank == 0 and self.step_count % self.options.train.summary_steps == 0:
                     self.train_summaries(batch, *out)
 
                 # Save checkpoint every checkpoint_steps steps
@@ -176,3 +241,6 @@ class Trainer(CheckpointRunner):
     def test(self):
         for evaluator in self.evaluators:
             evaluator.evaluate()
+        if self.distributed:
+            # other processes wait for the evaluation of the first one
+            torch.distributed.barrier()
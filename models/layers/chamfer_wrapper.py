@@ -9,6 +9,9 @@ from torch.autograd import Function
 class ChamferFunction(Function):
     @staticmethod
     def forward(ctx, xyz1, xyz2):
+        # the kernel indexes raw memory and ignores strides
+        xyz1 = xyz1.contiguous()
+        xyz2 = xyz2.contiguous()
         batchsize, n, _ = xyz1.size()
         _, m, _ = xyz2.size()
 
@@ -17,7 +17,14 @@ class GConv(nn.Module):
         self.in_features = in_features
         self.out_features = out_features
 
-        self.adj_mat = nn.Parameter(adj_mat, requires_grad=False)
+        # The fixed adjacency is stored as dense index / value buffers instead of a sparse parameter:
+        # DistributedDataParallel can neither broadcast sparse tensors nor handle parameters without grad.
+        adj_mat = adj_mat.coalesce()
+        self.register_buffer("adj_indices", adj_mat._indices())
+        self.register_buffer("adj_values", adj_mat._values())
+        self.adj_size = adj_mat.size()
+        # sparse matrices built from the buffers, one per device; shared with DataParallel replicas
+        self._adj_mats = {}
         self.weight = nn.Parameter(torch.zeros((in_features, out_features), dtype=torch.float))
         # Following https://github.com/Tong-ZHAO/Pixel2Mesh-Pytorch/blob/a0ae88c4a42eef6f8f253417b97df978db842708/model/gcn_layers.py#L45
         # This seems to be different from the original implementation of P2M
@@ -28,6 +35,14 @@ class GConv(nn.Module):
             self.register_parameter('bias', None)
         self.reset_parameters()
 
+    @property
+    def adj_mat(self):
+        device = self.adj_values.device
+        if device not in self._adj_mats:
+            self._adj_mats[device] = torch.sparse_coo_tensor(self.adj_indices, self.adj_values,
+                                                             self.adj_size).coalesce()
+        return self._adj_mats[device]
+
     def reset_parameters(self):
         nn.init.xavier_uniform_(self.weight.data)
         nn.init.xavier_uniform_(self.loop_weight.data)
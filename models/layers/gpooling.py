@@ -12,15 +12,31 @@ class GUnpooling(nn.Module):
 
     def __init__(self, unpool_idx):
         super(GUnpooling, self).__init__()
-        self.unpool_idx = unpool_idx
+        # a buffer moves to the GPU with the model, instead of the index being copied on every forward
+        self.register_buffer("unpool_idx", unpool_idx)
         # save dim info
         self.in_num = torch.max(unpool_idx).item()
         self.out_num = self.in_num + len(unpool_idx)
 
-    def forward(self, inputs):
-        new_features = inputs[:, self.unpool_idx].clone()
-        new_vertices = 0.5 * new_features.sum(2)
-        output = torch.cat([inputs, new_vertices], 1)
+    def forward(self, *inputs):
+        """
+        :param inputs: one or more feature tensors, batch_size x num_points x feat_dim each
+        :return: unpooled features of all inputs, concatenated along the feature axis
+        Unpooling inputs separately gives the same result as unpooling their concatenation,
+        so every input is written straight into its slice of the output without a concatenated copy.
+        """
+        batch_size, num_points = inputs[0].size(0), inputs[0].size(1)
+        output = inputs[0].new_empty((batch_size, num_points + len(self.unpool_idx),
+                                      sum(x.size(2) for x in inputs)))
+        # index_select with the flattened index gathers both edge vertices in a single kernel
+        flat_idx = self.unpool_idx.view(-1)
+        start = 0
+        for x in inputs:
+            end = start + x.size(2)
+            output[:, :num_points, start:end] = x
+            output[:, num_points:, start:end] = x.index_select(1, flat_idx) \
+                .view(batch_size, -1, 2, x.size(2)).sum(2).mul_(0.5)
+            start = end
 
         return output
 
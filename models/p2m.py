@@ -1,4 +1,3 @@
-import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -17,7 +16,7 @@ class P2MModel(nn.Module):
         self.hidden_dim = options.hidden_dim
         self.coord_dim = options.coord_dim
         self.last_hidden_dim = options.last_hidden_dim
-        self.init_pts = nn.Parameter(ellipsoid.coord, requires_grad=False)
+        self.register_buffer("init_pts", ellipsoid.coord)
         self.gconv_activation = options.gconv_activation
 
         self.nn_encoder, self.nn_decoder = get_backbone(options)
@@ -52,7 +51,7 @@ class P2MModel(nn.Module):
         img_feats = self.nn_encoder(img)
         img_shape = self.projection.image_feature_shape(img)
 
-        init_pts = self.init_pts.data.unsqueeze(0).expand(batch_size, -1, -1)
+        init_pts = self.init_pts.unsqueeze(0).expand(batch_size, -1, -1)
         # GCN Block 1
         x = self.projection(img_shape, img_feats, init_pts)
         x1, x_hidden = self.gcns[0](x)
@@ -62,7 +61,7 @@ class P2MModel(nn.Module):
 
         # GCN Block 2
         x = self.projection(img_shape, img_feats, x1)
-        x = self.unpooling[0](torch.cat([x, x_hidden], 2))
+        x = self.unpooling[0](x, x_hidden)
         # after deformation 2
         x2, x_hidden = self.gcns[1](x)
 
@@ -71,7 +70,7 @@ class P2MModel(nn.Module):
 
         # GCN Block 3
         x = self.projection(img_shape, img_feats, x2)
-        x = self.unpooling[1](torch.cat([x, x_hidden], 2))
+        x = self.unpooling[1](x, x_hidden)
         x3, _ = self.gcns[2](x)
         if self.gconv_activation:
             x3 = F.relu(x3)
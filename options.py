@@ -37,6 +37,12 @@ options.dataset.num_classes = 13
 options.dataset.shapenet = edict()
 options.dataset.shapenet.num_points = 3000
 options.dataset.shapenet.resize_with_constant_border = False
+# read point clouds from the shard written by utils/migrations/pack_shapenet_points.py instead of pickles
+options.dataset.shapenet.memmap_points = False
+# number of samples every DataLoader worker of training keeps in memory, least recently used first out; 0 to disable.
+# batches go to workers round-robin while the sampler shuffles, so a revisited sample hits the cache
+# of its worker only about 1 / num_workers of the time, while memory grows as num_workers x cache_size
+options.dataset.shapenet.cache_size = 0
 
 options.dataset.predict = edict()
 options.dataset.predict.folder = "/tmp"
@@ -75,6 +81,10 @@ options.train.checkpoint_steps = 10000
 options.train.test_epochs = 1
 options.train.use_augmentation = True
 options.train.shuffle = True
+# automatic mixed precision for the model forward, needs PyTorch >= 1.6
+options.train.mixed_precision = False
+# compile the model with torch.compile (TorchInductor), needs PyTorch >= 2.0
+options.train.compile_model = False
 
 options.test = edict()
 options.test.dataset = []
@@ -86,6 +96,8 @@ options.test.weighted_mean = False
 options.optim = edict()
 options.optim.name = "adam"
 options.optim.adam_beta1 = 0.9
+# update all parameters with the fused CUDA Adam kernel, needs PyTorch >= 2.0
+options.optim.adam_fused = False
 options.optim.sgd_momentum = 0.9
 options.optim.lr = 5.0E-5
 options.optim.wd = 1.0E-6
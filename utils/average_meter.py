@@ -21,8 +21,11 @@ class AverageMeter(object):
 
     def update(self, val, n=1):
         if isinstance(val, torch.Tensor):
-            val = val.cpu().numpy()
-        if isinstance(val, Iterable):
+            if val.dim() > 0:
+                val = val.cpu().numpy()
+            # scalar tensors are accumulated on their device, so that updating does not wait for the GPU;
+            # they are only copied back when val / avg are printed
+        if isinstance(val, Iterable) and not isinstance(val, torch.Tensor):
             val = np.array(val)
             self.update(np.mean(np.array(val)), n=val.size)
         else:
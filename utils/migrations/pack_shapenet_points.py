@@ -0,0 +1,40 @@
+"""
+Pack the point clouds of a ShapeNet file list (tensorflow version of data) into one memory-mapped shard,
+so that training with `dataset.shapenet.memmap_points: true` slices rows instead of unpickling a file per sample.
+
+Usage (from the repository root):
+    python -m utils.migrations.pack_shapenet_points --subset train_tf
+"""
+import os
+import pickle
+from argparse import ArgumentParser
+
+import numpy as np
+from tqdm import tqdm
+
+import config
+from datasets.shapenet import ShapeNet, packed_points_dir
+from options import options
+
+parser = ArgumentParser("Pack ShapeNet point clouds into a memory-mapped shard")
+parser.add_argument("--subset", type=str, required=True, help="file list name in meta, e.g. train_tf")
+parser.add_argument("--root", type=str, default=config.SHAPENET_ROOT)
+args = parser.parse_args()
+
+dataset = ShapeNet(args.root, args.subset, options.dataset.mesh_pos, False, options.dataset.shapenet)
+if not dataset.tensorflow:
+    raise ValueError("Only tensorflow version of data can be packed")
+
+output_dir = packed_points_dir(args.root, args.subset)
+os.makedirs(output_dir, exist_ok=True)
+
+offsets = np.zeros(len(dataset) + 1, dtype=np.int64)
+with open(os.path.join(output_dir, "points.bin"), "wb") as f:
+    for i in tqdm(range(len(dataset))):
+        _, _, pkl_path = dataset.tf_file(i)
+        with open(pkl_path, "rb") as fp:
+            data = np.asarray(pickle.load(fp, encoding="latin1"), dtype=np.float32)
+        data.tofile(f)
+        offsets[i + 1] = offsets[i] + data.shape[0]
+np.save(os.path.join(output_dir, "offsets.npy"), offsets)
+print("=> packed %d point clouds (%d points) into %s" % (len(dataset), offsets[-1], output_dir))
@@ -16,12 +16,31 @@ def recursive_detach(t):
         return t
 
 
+def recursive_float(t):
+    if isinstance(t, torch.Tensor):
+        return t.float()
+    elif isinstance(t, list):
+        return [recursive_float(x) for x in t]
+    elif isinstance(t, dict):
+        return {k: recursive_float(v) for k, v in t.items()}
+    else:
+        return t
+
+
 def batch_mm(matrix, batch):
     """
     https://github.com/pytorch/pytorch/issues/14489
+    :param matrix: (sparse) n x n
+    :param batch: batch_size x n x f
+    :return: batch_size x n x f
+    The samples are laid side by side as one n x (batch_size * f) matrix,
+    so that a single (sparse) product serves the whole batch.
+    The result is copied back to a contiguous batch_size x n x f layout, as callers
+    (e.g. the chamfer CUDA kernel) read the raw memory of what is derived from it.
     """
-    # TODO: accelerate this with batch operations
-    return torch.stack([matrix.mm(b) for b in batch], dim=0)
+    batch_size, n, f = batch.size()
+    output = matrix.mm(batch.transpose(0, 1).reshape(n, batch_size * f))
+    return output.view(n, batch_size, f).transpose(0, 1).contiguous()
 
 
 def dot(x, y, sparse=False):